@@ -3,7 +3,13 @@ import duckdb
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+import altair as alt
+import glob
 import io
+import os
+import re
+import time
+import unicodedata
 import boto3
 from datetime import datetime
 from pydantic import BaseModel, Field
@@ -29,18 +35,13 @@ st.set_page_config(
 # 2. DISEÑO PROFESIONAL
 # ==========================================
 
+# Colores base (fondo, sidebar, texto, acento) en .streamlit/config.toml [theme];
+# aquí solo queda lo que el tema no cubre
 def set_design():
     st.markdown("""
         <style>
-        /* Fondo y texto principal */
-        .stApp {
-            background-color: #0E1117;
-            color: #FFFFFF;
-        }
-
-        /* Sidebar con contraste */
+        /* Borde del sidebar */
         [data-testid="stSidebar"] {
-            background-color: #161B22 !important;
             border-right: 1px solid #30363D;
         }
         
@@ -63,17 +64,14 @@ def set_design():
         [data-testid="stMetricLabel"] {
             color: #A0A0A0 !important;
             font-size: 1rem !important;
+        }
+
         /* Estilo para las tablas: Zebra stripes y fondo oscuro */
         .stDataFrame {
             background-color: #1C2128 !important;
             border: 1px solid #30363D !important;
             border-radius: 8px !important;
         }
-        
-        /* Color del slider de registros */
-        .stSlider [data-baseweb="slider"] {
-            color: #00F2FF;
-        }
         </style>
     """, unsafe_allow_html=True)
 
@@ -112,41 +110,120 @@ def check_password():
 # 4. CARGA DE DATOS DESDE R2
 # ==========================================
 
-@st.cache_resource(ttl=3600)
-def load_data_from_r2():
-    try:
-        settings = st.secrets["R2"]
-        con = duckdb.connect(database=':memory:')
-        con.execute("INSTALL httpfs; LOAD httpfs;")
-        
-        endpoint = settings["R2_ENDPOINT"].replace("https://", "")
-        con.execute(f"SET s3_endpoint='{endpoint}'")
-        con.execute(f"SET s3_access_key_id='{settings['ACCESS_KEY']}'")
-        con.execute(f"SET s3_secret_access_key='{settings['SECRET_KEY']}'")
-        con.execute("SET s3_region='auto'")
-        
-        s3_url = f"s3://{settings['R2_BUCKET_NAME']}/07OCCompraAgil.parquet"
-        
-        with st.spinner('🚀 Cargando inteligencia de salud...'):
-            con.execute(f"CREATE OR REPLACE TABLE compras AS SELECT * FROM read_parquet('{s3_url}')")
-            
-            # --- SOLUCIÓN AL BINDEREXCEPTION ---
-            # Esto quita espacios y paréntesis de los nombres (ej: "Monto Total" -> "MontoTotal")
-            cols = con.execute("PRAGMA table_info('compras')").df()['name'].tolist()
-            for col in cols:
-                clean_name = col.replace(" ", "").replace("(", "_").replace(")", "")
-                if clean_name != col:
-                    con.execute(f'ALTER TABLE compras RENAME "{col}" TO "{clean_name}"')
-            
-            # Ahora las columnas como FechaEnvioOC ya existen sin espacios
-            con.execute("""
-                ALTER TABLE compras ADD COLUMN IF NOT EXISTS FechaEnvioOC_parsed DATE;
-                UPDATE compras SET FechaEnvioOC_parsed = strptime(FechaEnvioOC, '%d-%m-%Y %H:%M:%S')::DATE;
-            """)
-            
-        return con, None
-    except Exception as e:
-        return None, str(e)
+# Copia local en formato nativo de DuckDB: R2 solo se consulta si falta o está vencida
+# Cada carga va a un archivo versionado (compras-<epoch>.duckdb): DuckDB reutiliza la
+# instancia abierta de una misma ruta, así que reemplazar el archivo no bastaría
+DB_DIR = "/tmp"
+DB_MAX_EDAD = 24 * 3600  # segundos
+
+def _bases_locales() -> list[str]:
+    # Más reciente primero
+    return sorted(glob.glob(os.path.join(DB_DIR, "compras-*.duckdb")), key=os.path.getmtime, reverse=True)
+
+def _descargar_e_ingestar(db_path: str) -> None:
+    settings = st.secrets["R2"]
+    # Se construye en un archivo aparte y se reemplaza al final, así nunca queda una base a medias
+    tmp_path = f"{db_path}.tmp"
+    for path in (tmp_path, f"{tmp_path}.wal"):
+        if os.path.exists(path):
+            os.remove(path)
+    
+    con = duckdb.connect(database=tmp_path)
+    con.execute("INSTALL httpfs; LOAD httpfs;")
+    
+    endpoint = settings["R2_ENDPOINT"].replace("https://", "")
+    con.execute(f"SET s3_endpoint='{endpoint}'")
+    con.execute(f"SET s3_access_key_id='{settings['ACCESS_KEY']}'")
+    con.execute(f"SET s3_secret_access_key='{settings['SECRET_KEY']}'")
+    con.execute("SET s3_region='auto'")
+    con.execute("SET s3_url_style='path'")
+    
+    # Parquet particionado por año/mes (ver convertir_a_parquet.py)
+    s3_url = f"s3://{settings['R2_BUCKET_NAME']}/compras/*/*/*.parquet"
+    
+    # Solo se leen las columnas que usa el dashboard; las columnas derivadas
+    # se calculan en la misma pasada de carga
+    con.execute(f"""
+        CREATE TEMP TABLE compras_raw AS
+        SELECT
+            codigoOC,
+            strptime(FechaEnvioOC, '%d-%m-%Y %H:%M:%S')::DATE AS FechaEnvioOC_parsed,
+            Proveedor,
+            -- Nombre en minúsculas y sin tildes: la búsqueda no repite LOWER() por fila
+            strip_accents(LOWER(Proveedor)) AS Proveedor_norm,
+            ProveedorRUT,
+            RegionProveedor,
+            RegionUnidadCompra,
+            ONUProducto,
+            RubroN1,
+            (LOWER(RubroN1) LIKE '%salud%' OR LOWER(RubroN1) LIKE '%médico%') AS is_salud,
+            TRY_CAST(MontoTotalOC AS DOUBLE) AS Monto_CLP_num
+        FROM read_parquet('{s3_url}', hive_partitioning=1)
+    """)
+    
+    # Columnas de baja cardinalidad como ENUM: códigos de 1-2 bytes en group-by y filtros
+    con.execute("""
+        CREATE TYPE region_t AS ENUM (
+            SELECT DISTINCT r FROM (
+                SELECT RegionProveedor AS r FROM compras_raw
+                UNION
+                SELECT RegionUnidadCompra FROM compras_raw
+            ) WHERE r IS NOT NULL ORDER BY r
+        )
+    """)
+    con.execute("CREATE TYPE especialidad_t AS ENUM (SELECT DISTINCT ONUProducto FROM compras_raw WHERE ONUProducto IS NOT NULL ORDER BY ONUProducto)")
+    con.execute("CREATE TYPE rubro_t AS ENUM (SELECT DISTINCT RubroN1 FROM compras_raw WHERE RubroN1 IS NOT NULL ORDER BY RubroN1)")
+    
+    con.execute("""
+        CREATE TABLE compras AS
+        SELECT
+            codigoOC,
+            FechaEnvioOC_parsed,
+            Proveedor,
+            Proveedor_norm,
+            ProveedorRUT,
+            RegionProveedor::region_t AS RegionProveedor,
+            RegionUnidadCompra::region_t AS RegionUnidadCompra,
+            ONUProducto::especialidad_t AS ONUProducto,
+            RubroN1::rubro_t AS RubroN1,
+            is_salud,
+            Monto_CLP_num
+        FROM compras_raw
+        -- Orden físico por los filtros más usados: los zonemaps permiten saltar row groups
+        ORDER BY FechaEnvioOC_parsed, RegionProveedor
+    """)
+    con.execute("DROP TABLE compras_raw")
+    
+    # Índice ART solo para ProveedorRUT; ONUProducto tiene pocas categorías y el
+    # planificador nunca usaba un índice sobre ella
+    con.execute("CREATE INDEX idx_rut ON compras(ProveedorRUT)")
+    
+    con.close()
+    os.replace(tmp_path, db_path)
+
+# cache_resource comparte la conexión entre sesiones sin serializarla.
+# Si la carga falla se lanza la excepción, así el error no queda en caché.
+@st.cache_resource(ttl=3600, show_spinner='🚀 Cargando inteligencia de salud...')
+def load_data_from_r2() -> duckdb.DuckDBPyConnection:
+    bases = _bases_locales()
+    if bases and os.path.getmtime(bases[0]) >= time.time() - DB_MAX_EDAD:
+        db_path = bases[0]
+    else:
+        db_path = os.path.join(DB_DIR, f"compras-{int(time.time())}.duckdb")
+        _descargar_e_ingestar(db_path)
+    
+    # Versiones anteriores (y restos .tmp/.wal de cargas fallidas) ya no se usan
+    for viejo in glob.glob(os.path.join(DB_DIR, "compras-*.duckdb*")):
+        if viejo != db_path:
+            os.remove(viejo)
+    
+    con = duckdb.connect(database=db_path, read_only=True)
+    return con
+
+def _cursor() -> duckdb.DuckDBPyConnection:
+    # Un cursor por consulta sobre la base compartida: cada uno tiene su propio contexto
+    # de transacción, así las sesiones concurrentes no se serializan en una sola conexión
+    return load_data_from_r2().cursor()
 
 # ==========================================
 # 5. LISTAS DE REFERENCIA
@@ -160,7 +237,240 @@ REGIONES_CHILE = [
 ]
 
 # ==========================================
-# 6. DASHBOARD PRINCIPAL
+# 6. FILTROS Y CONSULTAS
+# ==========================================
+
+# Largo mínimo del término de búsqueda antes de filtrar
+MIN_BUSQUEDA = 3
+
+def normalizar(texto: str) -> str:
+    # Igual que Proveedor_norm en la carga: minúsculas y sin tildes
+    sin_tildes = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in sin_tildes if not unicodedata.combining(c)).lower()
+
+# RUT con dígito verificador, con o sin puntos (ej: 76.123.456-7 / 76123456-K)
+RUT_COMPLETO = re.compile(r'\d{1,2}\.?\d{3}\.?\d{3}-[\dkK]')
+
+def normalizar_rut(rut: str) -> str:
+    # Mismo formato que ProveedorRUT en la base: sin puntos y con K mayúscula
+    return rut.replace('.', '').upper()
+
+# Los resultados se cachean por combinación de filtros:
+# filtros = (solo_salud, fecha_inicio, fecha_fin, region_proveedor,
+#            region_compra, especialidad_selected, search_term)
+
+def construir_where(filtros: tuple) -> tuple[str, list]:
+    # SQL fijo con parámetros "?", así DuckDB reutiliza el plan y se evita inyección SQL
+    solo_salud, fecha_inicio, fecha_fin, region_proveedor, region_compra, especialidad_selected, search_term = filtros
+    where_clauses = []
+    params = []
+    
+    # 1. Filtro de salud
+    if solo_salud:
+        where_clauses.append("is_salud")
+    
+    # 2. Filtro de fechas
+    where_clauses.append("FechaEnvioOC_parsed >= ?")
+    where_clauses.append("FechaEnvioOC_parsed <= ?")
+    params += [fecha_inicio, fecha_fin]
+    
+    # 3. Filtro de regiones (parámetro con el tipo ENUM de la columna: así se comparan
+    #    códigos del ENUM en vez de castear cada fila a VARCHAR)
+    if region_proveedor != 'Todas':
+        where_clauses.append("RegionProveedor = TRY_CAST(? AS region_t)")
+        params.append(region_proveedor)
+    
+    if region_compra != 'Todas':
+        where_clauses.append("RegionUnidadCompra = TRY_CAST(? AS region_t)")
+        params.append(region_compra)
+    
+    # 4. Filtro de especialidad
+    if especialidad_selected != 'Todas':
+        where_clauses.append("ONUProducto = TRY_CAST(? AS especialidad_t)")
+        params.append(especialidad_selected)
+    
+    # 5. Filtro de búsqueda: RUT completo por igualdad (usa idx_rut),
+    #    si no, subcadena sobre el nombre normalizado y prefijo para el RUT
+    if search_term and RUT_COMPLETO.fullmatch(search_term):
+        where_clauses.append("ProveedorRUT = ?")
+        params.append(normalizar_rut(search_term))
+    elif search_term:
+        where_clauses.append("(Proveedor_norm LIKE ? OR ProveedorRUT LIKE ?)")
+        params += [f"%{normalizar(search_term)}%", f"{search_term}%"]
+    
+    # Unión final de los filtros
+    where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
+    return where_sql, params
+
+# Lista fija durante la vida del dataset: se calcula una vez, no en cada rerun
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_especialidades() -> list[str]:
+    with _cursor() as cur:
+        rows = cur.execute(
+            "SELECT DISTINCT ONUProducto FROM compras WHERE ONUProducto IS NOT NULL ORDER BY ONUProducto"
+        ).fetchall()
+    return ['Todas'] + [r[0] for r in rows]
+
+# KPIs escalares: se leen con fetchone(), sin construir un DataFrame
+KPIS_SQL = """
+    SELECT 
+        COUNT(DISTINCT ProveedorRUT) as total_adjudicadores,
+        COUNT(*) as total_ordenes,
+        COALESCE(SUM(Monto_CLP_num), 0) as monto_total,
+        COUNT(DISTINCT RegionProveedor) as regiones
+    FROM filtradas
+"""
+
+# Agregaciones sobre las filas ya filtradas: "filtradas" se materializa una sola vez
+CONSULTAS_RESUMEN = {
+    'top_especialidades': """
+        SELECT 
+            ONUProducto as especialidad,
+            COUNT(*) as cantidad
+        FROM filtradas
+        WHERE ONUProducto IS NOT NULL
+        GROUP BY ONUProducto
+        ORDER BY cantidad DESC
+        LIMIT 10
+    """,
+    'monto_region': """
+        SELECT 
+            RegionProveedor as region,
+            SUM(Monto_CLP_num) as monto
+        FROM filtradas
+        GROUP BY RegionProveedor
+        ORDER BY monto DESC
+        LIMIT 10
+    """,
+    'tendencia': """
+        SELECT 
+            DATE_TRUNC('month', FechaEnvioOC_parsed) as mes,
+            COUNT(*) as ordenes,
+            COUNT(DISTINCT ProveedorRUT) as proveedores
+        FROM filtradas
+        GROUP BY DATE_TRUNC('month', FechaEnvioOC_parsed)
+        ORDER BY mes
+    """,
+    # Ambas vistas regionales en un solo recorrido; se separan con _separar_regional
+    'regional': """
+        SELECT 
+            GROUPING(RegionProveedor) as g_prov,
+            RegionProveedor,
+            RegionUnidadCompra,
+            COUNT(DISTINCT ProveedorRUT) as adjudicadores,
+            COUNT(*) as ordenes,
+            SUM(Monto_CLP_num) as monto_total
+        FROM filtradas
+        GROUP BY GROUPING SETS ((RegionProveedor), (RegionUnidadCompra))
+    """,
+    'especialidades_completo': """
+        SELECT 
+            ONUProducto as especialidad,
+            COUNT(*) as ordenes,
+            COUNT(DISTINCT ProveedorRUT) as proveedores,
+            SUM(Monto_CLP_num) as monto_total,
+            AVG(Monto_CLP_num) as monto_promedio
+        FROM filtradas
+        WHERE ONUProducto IS NOT NULL
+        GROUP BY ONUProducto
+        ORDER BY ordenes DESC
+    """,
+}
+
+def _separar_regional(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # g_prov = 0: agrupado por RegionProveedor; g_prov = 1: por RegionUnidadCompra
+    adj_region = (
+        df[df['g_prov'] == 0]
+        .rename(columns={'RegionProveedor': 'region'})[['region', 'adjudicadores', 'ordenes']]
+        .sort_values('adjudicadores', ascending=False, ignore_index=True)
+    )
+    compras_region = (
+        df[df['g_prov'] == 1]
+        .rename(columns={'RegionUnidadCompra': 'region'})[['region', 'ordenes', 'monto_total']]
+        .sort_values('ordenes', ascending=False, ignore_index=True)
+    )
+    return adj_region, compras_region
+
+@st.cache_data(ttl=600, max_entries=128, show_spinner=False)
+def resumen_df(filtros: tuple) -> dict:
+    where_sql, params = construir_where(filtros)
+    with _cursor() as cur:
+        filtradas = cur.execute(f"""
+            SELECT
+                FechaEnvioOC_parsed,
+                ProveedorRUT,
+                RegionProveedor,
+                RegionUnidadCompra,
+                ONUProducto,
+                Monto_CLP_num
+            FROM compras
+            WHERE {where_sql}
+        """, params).fetch_arrow_table()
+        
+        # Las agregaciones corren en secuencia sobre el mismo cursor: cada una ya usa
+        # todos los hilos de DuckDB, un pool de hilos no las hacía más rápidas.
+        # La tabla Arrow se registra sin copiarla
+        cur.register('filtradas', filtradas)
+        # Arrow -> pandas convierte por columnas, sin pasar fila a fila
+        resumen = {
+            nombre: cur.execute(sql).fetch_arrow_table().to_pandas()
+            for nombre, sql in CONSULTAS_RESUMEN.items()
+        }
+        resumen['kpis'] = cur.execute(KPIS_SQL).fetchone()
+    
+    resumen['adj_region'], resumen['compras_region'] = _separar_regional(resumen.pop('regional'))
+    return resumen
+
+@st.cache_data(ttl=600, max_entries=128, show_spinner=False)
+def detalle_df(filtros: tuple, limit: int) -> pd.DataFrame:
+    where_sql, params = construir_where(filtros)
+    with _cursor() as cur:
+        return cur.execute(f"""
+            SELECT 
+                codigoOC,
+                FechaEnvioOC_parsed as Fecha,
+                Proveedor,
+                ProveedorRUT,
+                RegionProveedor,
+                RegionUnidadCompra,
+                ONUProducto as Especialidad,
+                RubroN1 as Rubro,
+                Monto_CLP_num as Monto_CLP
+            FROM compras
+            WHERE {where_sql}
+            ORDER BY FechaEnvioOC_parsed DESC
+            LIMIT ?
+        """, params + [limit]).fetch_arrow_table().to_pandas()
+
+# CSV de descarga: se escribe directo a bytes (sin str intermedio), con montos a 2 decimales,
+# y se cachea para no recodificar en cada rerun
+@st.cache_data(ttl=600, max_entries=32, show_spinner=False)
+def exportar_csv(df: pd.DataFrame) -> bytes:
+    buf = io.BytesIO()
+    df.to_csv(buf, index=False, float_format='%.2f', encoding='utf-8')
+    return buf.getvalue()
+
+# Formato por columna en el cliente (sin Styler, que arma HTML por celda); los valores
+# siguen siendo numéricos, así el orden por columna en st.dataframe es numérico.
+# Formatos predefinidos ("localized", "dollar") para conservar separadores de miles
+def columnas_numericas(formatos: dict) -> dict:
+    return {col: st.column_config.NumberColumn(format=fmt) for col, fmt in formatos.items()}
+
+# ==========================================
+# 7. GRÁFICOS
+# ==========================================
+
+# Barras horizontales con Altair (vega-lite): spec mucho más liviano que la figura Plotly
+def barras_horizontales(df, x, y, title, color, scheme):
+    return alt.Chart(df, title=title).mark_bar().encode(
+        x=alt.X(f'{x}:Q'),
+        y=alt.Y(f'{y}:N', sort='-x', title=None),
+        color=alt.Color(f'{color}:Q', scale=alt.Scale(scheme=scheme)),
+        tooltip=[y, x]
+    )
+
+# ==========================================
+# 8. DASHBOARD PRINCIPAL
 # ==========================================
 
 if check_password():
@@ -168,10 +478,10 @@ if check_password():
     st.markdown("**Dashboard de Análisis de Compras Ágiles en el Sector Salud**")
     
     # Cargar datos
-    con, error = load_data_from_r2()
-    
-    if con is None:
-        st.error(f" Error al cargar datos desde R2: {error}")
+    try:
+        load_data_from_r2()
+    except Exception as e:
+        st.error(f" Error al cargar datos desde R2: {e}")
         st.info("El sistema requiere acceso a R2 para funcionar correctamente.")
         st.stop()
     
@@ -199,68 +509,33 @@ if check_password():
     region_compra = st.sidebar.selectbox("Región Unidad de Compra", region_compra_options)
     
     # Especialidades (dinámico desde datos)
-    especialidades_query = "SELECT DISTINCT ONUProducto FROM compras WHERE ONUProducto IS NOT NULL ORDER BY ONUProducto"
-    especialidades_df = con.execute(especialidades_query).df()
-    especialidades = ['Todas'] + especialidades_df['ONUProducto'].tolist()
+    especialidades = get_especialidades()
     especialidad_selected = st.sidebar.selectbox("Especialidad/Servicio", especialidades)
     
     # Búsqueda
     st.sidebar.subheader("Búsqueda")
-    search_term = st.sidebar.text_input("Buscar Proveedor (Nombre o RUT)")
-    
-   # ==========================================
-    # CONSTRUCCIÓN DE FILTROS
-    # ==========================================
-    where_clauses = []
-    
-    # 1. Filtro de salud
-    if solo_salud:
-        where_clauses.append("(LOWER(RubroN1) LIKE '%salud%' OR LOWER(RubroN1) LIKE '%médico%')")
-    
-    # 2. Filtro de fechas
-    where_clauses.append(f"FechaEnvioOC_parsed >= DATE '{fecha_inicio}'")
-    where_clauses.append(f"FechaEnvioOC_parsed <= DATE '{fecha_fin}'")
-    
-    # 3. Filtro de regiones
-    if region_proveedor != 'Todas':
-        where_clauses.append(f"RegionProveedor = '{region_proveedor}'")
-    
-    if region_compra != 'Todas':
-        where_clauses.append(f"RegionUnidadCompra = '{region_compra}'")
-    
-    # 4. Filtro de especialidad
-    if especialidad_selected != 'Todas':
-        where_clauses.append(f"ONUProducto = '{especialidad_selected}'")
-    
-    # 5. Filtro de búsqueda (Usando la variable definida en la línea 195)
-    if search_term:
-        term_esc = search_term.lower().replace("'", "''")
-        where_clauses.append(f"(LOWER(Proveedor) LIKE '%{term_esc}%' OR ProveedorRUT LIKE '%{search_term}%')")
-    
-    # Unión final de los filtros
-    where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
+    search_term = st.sidebar.text_input(
+        "Buscar Proveedor (Nombre o RUT)",
+        help=f"Mínimo {MIN_BUSQUEDA} caracteres"
+    ).strip()
+    
+    # Evita relanzar consultas con términos demasiado cortos
+    if len(search_term) < MIN_BUSQUEDA:
+        search_term = ""
+    
+    # Combinación de filtros (clave de caché de las consultas)
+    filtros = (
+        solo_salud, fecha_inicio, fecha_fin,
+        region_proveedor, region_compra,
+        especialidad_selected, search_term
+    )
     
     # ==========================================
     # MÉTRICAS PRINCIPALES (KPIs)
     # ==========================================
     with st.spinner('Calculando métricas...'):
-        # Usamos 'MontoTotalOC' que es el nombre real en tu archivo de 63 columnas
-        kpi_query = f"""
-            SELECT 
-                COUNT(DISTINCT ProveedorRUT) as total_adjudicadores,
-                COUNT(*) as total_ordenes,
-                SUM(TRY_CAST(MontoTotalOC AS DOUBLE)) as monto_total
-            FROM compras
-            WHERE {where_sql}
-        """
-        
-        res_df = con.execute(kpi_query).df()
-        
-        # Verificación para evitar el fallo de iloc[0] si no hay resultados
-        if not res_df.empty:
-            kpis = res_df.iloc[0].fillna(0)
-        else:
-            kpis = {'total_adjudicadores': 0, 'total_ordenes': 0, 'monto_total': 0}
+        resumen = resumen_df(filtros)
+        total_adjudicadores, total_ordenes, monto_total, regiones_activas = resumen['kpis']
     
     # Mostrar KPIs
     col1, col2, col3, col4 = st.columns(4)
@@ -268,19 +543,19 @@ if check_password():
     with col1:
         st.metric(
             "Total Adjudicadores",
-            f"{int(kpis['total_adjudicadores']):,}",
+            f"{total_adjudicadores:,}",
             help="Proveedores únicos (por RUT)"
         )
     
     with col2:
         st.metric(
             "Órdenes de Compra",
-            f"{int(kpis['total_ordenes']):,}",
+            f"{total_ordenes:,}",
             help="Total de OC generadas"
         )
     
     with col3:
-        monto_miles_millones = kpis['monto_total'] / 1_000_000_000 if kpis['monto_total'] else 0
+        monto_miles_millones = monto_total / 1_000_000_000
         st.metric(
             "Monto Total",
             f"${monto_miles_millones:,.1f}B CLP",
@@ -288,12 +563,6 @@ if check_password():
         )
     
     with col4:
-        regiones_activas_query = f"""
-            SELECT COUNT(DISTINCT RegionProveedor) as regiones
-            FROM compras
-            WHERE {where_sql}
-        """
-        regiones_activas = con.execute(regiones_activas_query).df().iloc[0]['regiones']
         st.metric(
             "Regiones Activas",
             f"{int(regiones_activas)}",
@@ -325,54 +594,21 @@ if check_password():
         with col1:
             st.subheader("Top 10 Especialidades Más Contratadas")
             
-            top_especialidades_query = f"""
-                SELECT 
-                    ONUProducto as especialidad,
-                    COUNT(*) as cantidad
-                FROM compras
-                WHERE {where_sql} AND ONUProducto IS NOT NULL
-                GROUP BY ONUProducto
-                ORDER BY cantidad DESC
-                LIMIT 10
-            """
-            df_esp = con.execute(top_especialidades_query).df()
+            df_esp = resumen['top_especialidades']
             
         if not df_esp.empty:
-            fig1 = px.bar(
-                df_esp,
-                x='cantidad',
-                y='especialidad',
-                orientation='h',
-                title='Cantidad de Órdenes por Especialidad',
-                color='cantidad',
-                color_continuous_scale='Blues'
+            fig1 = barras_horizontales(
+                df_esp, 'cantidad', 'especialidad',
+                'Cantidad de Órdenes por Especialidad', color='cantidad', scheme='blues'
             )
-            fig1.update_layout(
-                template="plotly_dark",
-                plot_bgcolor='rgba(0,0,0,0)',
-                paper_bgcolor='rgba(0,0,0,0)',
-                font_color='#FFFFFF',
-                margin=dict(l=20, r=20, t=50, b=20),
-                yaxis={'categoryorder':'total ascending'}
-            )
-            st.plotly_chart(fig1, use_container_width=True)
+            st.altair_chart(fig1, use_container_width=True)
         else:
             st.info("No hay datos para mostrar con los filtros seleccionados")
         
         with col2:
             st.subheader("Distribución de Montos por Región")
             
-            monto_region_query = f"""
-                SELECT 
-                    RegionProveedor as region,
-                    SUM(TRY_CAST(MontoTotalOC AS DOUBLE)) as monto
-                FROM compras
-                WHERE {where_sql}
-                GROUP BY RegionProveedor
-                ORDER BY monto DESC
-                LIMIT 10
-            """
-            df_monto = con.execute(monto_region_query).df()
+            df_monto = resumen['monto_region']
         
         if not df_monto.empty:
             fig2 = px.pie(
@@ -395,17 +631,7 @@ if check_password():
         # Tendencia temporal
         st.subheader("Tendencia Temporal de Órdenes")
         
-        tendencia_query = f"""
-            SELECT 
-                DATE_TRUNC('month', FechaEnvioOC_parsed) as mes,
-                COUNT(*) as ordenes,
-                COUNT(DISTINCT ProveedorRUT) as proveedores
-            FROM compras
-            WHERE {where_sql}
-            GROUP BY DATE_TRUNC('month', FechaEnvioOC_parsed)
-            ORDER BY mes
-        """
-        df_tend = con.execute(tendencia_query).df()
+        df_tend = resumen['tendencia']
         
         if not df_tend.empty:
             fig3 = go.Figure()
@@ -443,92 +669,52 @@ if check_password():
         with col1:
             st.subheader("Adjudicadores por Región del Proveedor")
             
-            adj_region_query = f"""
-                SELECT 
-                    RegionProveedor as region,
-                    COUNT(DISTINCT ProveedorRUT) as adjudicadores,
-                    COUNT(*) as ordenes
-                FROM compras
-                WHERE {where_sql}
-                GROUP BY RegionProveedor
-                ORDER BY adjudicadores DESC
-            """
-            df_adj_reg = con.execute(adj_region_query).df()
+            df_adj_reg = resumen['adj_region']
             
             if not df_adj_reg.empty:
                 st.dataframe(
-                    df_adj_reg.style.format({
-                        'adjudicadores': '{:,}',
-                        'ordenes': '{:,}'
+                    df_adj_reg,
+                    column_config=columnas_numericas({
+                        'adjudicadores': 'localized',
+                        'ordenes': 'localized'
                     }),
                     use_container_width=True,
                     height=400
                 )
                 
                 # Gráfico
-                fig4 = px.bar(
-                    df_adj_reg,
-                    x='adjudicadores',
-                    y='region',
-                    orientation='h',
-                    title='Proveedores Únicos por Región',
-                    color='adjudicadores',
-                    color_continuous_scale='Viridis'
+                fig4 = barras_horizontales(
+                    df_adj_reg, 'adjudicadores', 'region',
+                    'Proveedores Únicos por Región', color='adjudicadores', scheme='viridis'
                 )
-                fig4.update_layout(
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    font_color='white',
-                    yaxis={'categoryorder':'total ascending'}
-                )
-                st.plotly_chart(fig4, use_container_width=True)
+                st.altair_chart(fig4, use_container_width=True)
             else:
                 st.info("No hay datos")
         
         with col2:
             st.subheader("Compras por Región Unidad Compradora")
             
-            compras_region_query = f"""
-                SELECT 
-                    RegionUnidadCompra as region,
-                    COUNT(*) as ordenes,
-                    SUM(TRY_CAST(MontoTotalOC AS DOUBLE)) as monto_total
-                FROM compras
-                WHERE {where_sql}
-                GROUP BY RegionUnidadCompra
-                ORDER BY ordenes DESC
-            """
-            df_comp_reg = con.execute(compras_region_query).df()
+            df_comp_reg = resumen['compras_region']
             
             if not df_comp_reg.empty:
                 df_comp_reg['monto_millones'] = df_comp_reg['monto_total'] / 1_000_000
                 
                 st.dataframe(
-                    df_comp_reg[['region', 'ordenes', 'monto_millones']].style.format({
-                        'ordenes': '{:,}',
-                        'monto_millones': '${:,.1f}M'
+                    df_comp_reg[['region', 'ordenes', 'monto_millones']],
+                    column_config=columnas_numericas({
+                        'ordenes': 'localized',
+                        'monto_millones': 'dollar'
                     }),
                     use_container_width=True,
                     height=400
                 )
                 
                 # Gráfico
-                fig5 = px.bar(
-                    df_comp_reg,
-                    x='ordenes',
-                    y='region',
-                    orientation='h',
-                    title='Órdenes por Región Compradora',
-                    color='monto_millones',
-                    color_continuous_scale='RdYlGn'
-                )
-                fig5.update_layout(
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    font_color='white',
-                    yaxis={'categoryorder':'total ascending'}
+                fig5 = barras_horizontales(
+                    df_comp_reg, 'ordenes', 'region',
+                    'Órdenes por Región Compradora', color='monto_millones', scheme='redyellowgreen'
                 )
-                st.plotly_chart(fig5, use_container_width=True)
+                st.altair_chart(fig5, use_container_width=True)
             else:
                 st.info("No hay datos")
     
@@ -539,19 +725,7 @@ if check_password():
     with tab3:
         st.header("Análisis por Especialidad")
         
-        especialidades_completo_query = f"""
-            SELECT 
-                ONUProducto as especialidad,
-                COUNT(*) as ordenes,
-                COUNT(DISTINCT ProveedorRUT) as proveedores,
-                SUM(TRY_CAST(MontoTotalOC AS DOUBLE)) as monto_total,
-                AVG(TRY_CAST(MontoTotalOC AS DOUBLE)) as monto_promedio
-            FROM compras
-            WHERE {where_sql} AND ONUProducto IS NOT NULL
-            GROUP BY ONUProducto
-            ORDER BY ordenes DESC
-        """
-        df_esp_completo = con.execute(especialidades_completo_query).df()
+        df_esp_completo = resumen['especialidades_completo']
         
         if not df_esp_completo.empty:
             df_esp_completo['monto_total_millones'] = df_esp_completo['monto_total'] / 1_000_000
@@ -562,19 +736,20 @@ if check_password():
                 df_esp_completo[[
                     'especialidad', 'ordenes', 'proveedores',
                     'monto_total_millones', 'monto_promedio_miles', 'participacion'
-                ]].style.format({
-                    'ordenes': '{:,}',
-                    'proveedores': '{:,}',
-                    'monto_total_millones': '${:,.1f}M',
-                    'monto_promedio_miles': '${:,.0f}K',
-                    'participacion': '{:.1f}%'
+                ]],
+                column_config=columnas_numericas({
+                    'ordenes': 'localized',
+                    'proveedores': 'localized',
+                    'monto_total_millones': 'dollar',
+                    'monto_promedio_miles': 'dollar',
+                    'participacion': '%.1f%%'
                 }),
                 use_container_width=True,
                 height=600
             )
             
             # Exportar
-            csv = df_esp_completo.to_csv(index=False).encode('utf-8')
+            csv = exportar_csv(df_esp_completo)
             st.download_button(
                 label="Descargar Tabla como CSV",
                 data=csv,
@@ -594,39 +769,23 @@ if check_password():
         # Límite de registros a mostrar
         limit = st.slider("Número de registros a mostrar", 100, 5000, 1000, 100)
         
-        detalle_query = f"""
-            SELECT 
-                codigoOC,
-                FechaEnvioOC_parsed as Fecha,
-                Proveedor,
-                ProveedorRUT,
-                RegionProveedor,
-                RegionUnidadCompra,
-                ONUProducto as Especialidad,
-                RubroN1 as Rubro,
-                TRY_CAST(MontoTotalOC AS DOUBLE) as Monto_CLP
-            FROM compras
-            WHERE {where_sql}
-            ORDER BY FechaEnvioOC_parsed DESC
-            LIMIT {limit}
-        """
-        
         with st.spinner(f'Cargando {limit} registros...'):
-            df_detalle = con.execute(detalle_query).df()
+            df_detalle = detalle_df(filtros, limit)
         
         if not df_detalle.empty:
-            st.write(f"**Mostrando {len(df_detalle):,} de {int(kpis['total_ordenes']):,} registros**")
+            st.write(f"**Mostrando {len(df_detalle):,} de {total_ordenes:,} registros**")
             
             st.dataframe(
-                df_detalle.style.format({
-                    'Monto_CLP': '${:,.0f}'
+                df_detalle,
+                column_config=columnas_numericas({
+                    'Monto_CLP': 'dollar'
                 }),
                 use_container_width=True,
                 height=600
             )
             
             # Exportar datos filtrados
-            csv_detalle = df_detalle.to_csv(index=False).encode('utf-8')
+            csv_detalle = exportar_csv(df_detalle)
             st.download_button(
                 label="Descargar Datos Filtrados (CSV)",
                 data=csv_detalle,
@@ -0,0 +1,148 @@
+"""
+Job offline (se ejecuta una sola vez, fuera de la app):
+convierte 07OCCompraAgil.csv en R2 a Parquet particionado por mes de FechaEnvioOC.
+
+Uso:
+    python convertir_a_parquet.py
+
+Lee las credenciales desde .streamlit/secrets.toml (sección [R2]), igual que app.py.
+"""
+import os
+import tempfile
+import tomllib
+
+import boto3
+import duckdb
+from boto3.s3.transfer import TransferConfig
+
+# ==========================================
+# 1. CONFIGURACIÓN
+# ==========================================
+
+SECRETS_PATH = ".streamlit/secrets.toml"
+CSV_KEY = "07OCCompraAgil.csv"
+PARQUET_PREFIX = "compras"
+
+# Únicas columnas que usa el dashboard (nombres ya limpios)
+COLUMNAS = [
+    "codigoOC",
+    "FechaEnvioOC",
+    "Proveedor",
+    "ProveedorRUT",
+    "RegionProveedor",
+    "RegionUnidadCompra",
+    "ONUProducto",
+    "RubroN1",
+    "MontoTotalOC",
+]
+
+COLUMNAS_NUMERICAS = {"MontoTotalOC"}
+
+FORMATO_FECHA = "%d-%m-%Y %H:%M:%S"
+
+MB = 1024 * 1024
+
+# Descarga multiparte: GETs por rangos en paralelo, memoria acotada a ~chunksize * concurrency
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * MB,
+    multipart_chunksize=16 * MB,
+    max_concurrency=16,
+    max_io_queue=10000,
+    io_chunksize=1 * MB,
+)
+
+
+def limpiar_nombre(col):
+    # Misma regla que usaba app.py: "Monto Total (CLP)" -> "MontoTotal_CLP"
+    return col.replace(" ", "").replace("(", "_").replace(")", "")
+
+
+# ==========================================
+# 2. DESCARGA
+# ==========================================
+
+def descargar_csv(settings):
+    s3 = boto3.client(
+        "s3",
+        endpoint_url=settings["R2_ENDPOINT"],
+        aws_access_key_id=settings["ACCESS_KEY"],
+        aws_secret_access_key=settings["SECRET_KEY"],
+        region_name="auto",
+    )
+    with tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as f:
+        try:
+            s3.download_fileobj(settings["R2_BUCKET_NAME"], CSV_KEY, f, Config=TRANSFER_CONFIG)
+        except BaseException:
+            # No dejar un CSV parcial (posiblemente de varios GB) en el directorio temporal
+            f.close()
+            os.remove(f.name)
+            raise
+        return f.name
+
+
+# ==========================================
+# 3. CONVERSIÓN
+# ==========================================
+
+def main():
+    with open(SECRETS_PATH, "rb") as f:
+        settings = tomllib.load(f)["R2"]
+
+    con = duckdb.connect(database=':memory:')
+    con.execute(f"PRAGMA threads={os.cpu_count()}")
+    # El orden de filas no importa al particionar; permite al lector paralelo no serializar
+    con.execute("SET preserve_insertion_order=false")
+    con.execute("INSTALL httpfs; LOAD httpfs;")
+
+    endpoint = settings["R2_ENDPOINT"].replace("https://", "")
+    con.execute(f"SET s3_endpoint='{endpoint}'")
+    con.execute(f"SET s3_access_key_id='{settings['ACCESS_KEY']}'")
+    con.execute(f"SET s3_secret_access_key='{settings['SECRET_KEY']}'")
+    con.execute("SET s3_region='auto'")
+    con.execute("SET s3_url_style='path'")
+
+    parquet_url = f"s3://{settings['R2_BUCKET_NAME']}/{PARQUET_PREFIX}"
+
+    print(f"Descargando {CSV_KEY} ...")
+    csv_path = descargar_csv(settings)
+    try:
+        convertir(con, csv_path, parquet_url)
+    finally:
+        os.remove(csv_path)
+    print("✅ Conversión terminada")
+
+
+def convertir(con, csv_path, parquet_url):
+    # Lector CSV paralelo sobre archivo local; all_varchar evita la inferencia de tipos
+    # y los tipos se fijan explícitamente en la proyección
+    origen = f"read_csv('{csv_path}', header=true, all_varchar=true)"
+
+    # Mapear nombres originales del CSV a nombres limpios
+    cols = con.execute(f"DESCRIBE SELECT * FROM {origen}").df()['column_name'].tolist()
+    originales = {limpiar_nombre(col): col for col in cols}
+
+    faltantes = [c for c in COLUMNAS if c not in originales]
+    if faltantes:
+        raise SystemExit(f"Columnas no encontradas en el CSV: {faltantes}")
+
+    select_cols = ",\n            ".join(
+        f'TRY_CAST("{originales[c]}" AS DOUBLE) AS {c}' if c in COLUMNAS_NUMERICAS
+        else f'"{originales[c]}" AS {c}'
+        for c in COLUMNAS
+    )
+    fecha = f"strptime(\"{originales['FechaEnvioOC']}\", '{FORMATO_FECHA}')"
+
+    print(f"Convirtiendo {csv_path} -> {parquet_url} ...")
+    con.execute(f"""
+        COPY (
+            SELECT
+            {select_cols},
+            year({fecha}) AS year,
+            month({fecha}) AS month
+            FROM {origen}
+        ) TO '{parquet_url}' (FORMAT PARQUET, PARTITION_BY (year, month), COMPRESSION ZSTD)
+    """)
+
+
+if __name__ == "__main__":
+    main()